@@ -0,0 +1,161 @@
+import os
+import asyncio
+import tempfile
+from typing import Any, Callable, Optional, Protocol
+import diskcache
+import redis.asyncio as redis
+from cachetools import TTLCache
+
+class CacheBackend(Protocol):
+    """Shared (L2) cache storage. Values are serialized strings."""
+
+    async def get(self, key: str) -> Optional[str]: ...
+
+    async def set(self, key: str, value: str, ttl: int) -> None: ...
+
+    async def delete(self, key: str) -> None: ...
+
+    async def clear(self, prefix: str) -> None: ...
+
+
+class NullBackend:
+    """No shared cache: used when the configured backend cannot be created (L1 only)."""
+
+    async def get(self, key: str) -> Optional[str]:
+        return None
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        pass
+
+    async def delete(self, key: str) -> None:
+        pass
+
+    async def clear(self, prefix: str) -> None:
+        pass
+
+
+class DiskCacheBackend:
+    def __init__(self, directory: str, size_limit: int = 2**30):
+        """
+        Local persistent cache: survives restarts and is shared by all workers on the host.
+        :param directory: cache directory (created if missing)
+        :param size_limit: max size on disk in bytes
+        """
+        self._cache = diskcache.Cache(directory, size_limit=size_limit)
+
+    # diskcache is blocking SQLite + file I/O; run it in worker threads
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._cache.get, key)
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        await asyncio.to_thread(self._cache.set, key, value, expire=ttl)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._cache.delete, key)
+
+    def _clear_prefix(self, prefix: str):
+        for key in list(self._cache.iterkeys()):
+            if isinstance(key, str) and key.startswith(prefix):
+                self._cache.delete(key)
+
+    async def clear(self, prefix: str) -> None:
+        await asyncio.to_thread(self._clear_prefix, prefix)
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        """
+        Redis cache shared across hosts (multi-worker / multi-instance deployments).
+        :param url: Redis connection URL, e.g. redis://localhost:6379/0
+        """
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        await self._redis.set(key, value, ex=ttl)
+
+    async def delete(self, key: str) -> None:
+        await self._redis.delete(key)
+
+    async def clear(self, prefix: str) -> None:
+        async for key in self._redis.scan_iter(match=f"{prefix}*"):
+            await self._redis.delete(key)
+
+
+def create_backend() -> CacheBackend:
+    """
+    Redis if REDIS_URL is set, otherwise a local disk cache (CACHE_DIR, default under the
+    system temp dir). Falls back to in-memory only if the backend cannot be created.
+    """
+    try:
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url:
+            return RedisBackend(redis_url)
+        return DiskCacheBackend(os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "api-comps-cache")))
+    except Exception as e:
+        print(f"[ERROR] Cache backend unavailable, using in-memory cache only: {e}")
+        return NullBackend()
+
+
+class TieredCache:
+    def __init__(self, namespace: str, backend: CacheBackend, maxsize: int, ttl: int,
+                 dumps: Callable[[Any], str], loads: Callable[[str], Any]):
+        """
+        In-process TTLCache (L1) in front of a shared backend (L2).
+        Lookups go L1 -> L2; L2 hits are deserialized and promoted to L1.
+        Backend errors are logged and treated as misses so the API keeps working without it.
+        :param namespace: key prefix in the shared backend
+        :param dumps: value -> str for the backend
+        :param loads: str -> value from the backend
+        """
+        self.namespace = namespace
+        self.backend = backend
+        self.l1 = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.dumps = dumps
+        self.loads = loads
+
+    def __len__(self):
+        return len(self.l1)
+
+    def keys(self):
+        return self.l1.keys()
+
+    async def get(self, key: str):
+        if key in self.l1:
+            return self.l1[key]
+        try:
+            raw = await self.backend.get(self.namespace + key)
+            if raw is None:
+                return None
+            value = self.loads(raw)
+        except Exception as e:
+            print(f"[ERROR] Cache backend read failed for {key}: {e}")
+            return None
+        self.l1[key] = value
+        return value
+
+    async def set(self, key: str, value):
+        self.l1[key] = value
+        try:
+            await self.backend.set(self.namespace + key, self.dumps(value), int(self.ttl))
+        except Exception as e:
+            print(f"[ERROR] Cache backend write failed for {key}: {e}")
+
+    async def pop(self, key: str):
+        """Remove key from both layers."""
+        self.l1.pop(key, None)
+        try:
+            await self.backend.delete(self.namespace + key)
+        except Exception as e:
+            print(f"[ERROR] Cache backend delete failed for {key}: {e}")
+
+    async def clear(self):
+        self.l1.clear()
+        try:
+            await self.backend.clear(self.namespace)
+        except Exception as e:
+            print(f"[ERROR] Cache backend clear failed: {e}")
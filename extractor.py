@@ -1,76 +1,332 @@
-import pandas as pd
 import openpyxl
+from python_calamine import CalamineWorkbook, SheetVisibleEnum
 import io
+import csv
+import tempfile
 import os
-import requests
-import json
+import httpx
+import asyncio
+import orjson
 import re
 from urllib.parse import quote
 from msal import ConfidentialClientApplication
 import time
-from google.api_core import exceptions
-import google.generativeai as genai
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from google import genai as genai_sdk
+from google.genai import errors as genai_errors
+from collections import deque
+from itertools import islice
 from typing import List, Dict, Optional, Set
 
+# Default extraction model and prompt revision; bump PROMPT_VERSION whenever the
+# extraction prompt changes so cached per-file results are invalidated
+EXTRACTION_MODEL = 'gemini-2.5-flash'
+PROMPT_VERSION = 'unified-v2'
+# Rows per sheet sent to Gemini; sheets are only read up to this many rows
+MAX_ROWS_PER_SHEET = 50
+
+# Gemini JSON mode schema for the unified extraction output. Companies are names + scores
+# only; per-company reasons are fetched on demand (explain_competitors) to keep output small.
+_COMPANY_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"name": {"type": "STRING"}, "score": {"type": "INTEGER"}},
+    "required": ["name", "score"]
+}
+EXTRACTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "ma_transactions": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    field: {"type": "STRING"}
+                    for field in ("target", "acquirer", "type", "acquisition_type",
+                                  "revenue", "valuation", "ev_revenue", "ev_ebitda")
+                },
+                "required": ["target", "acquirer"]
+            }
+        },
+        "public_comps": {
+            "type": "OBJECT",
+            "properties": {
+                "verified": {"type": "ARRAY", "items": _COMPANY_SCHEMA},
+                "to_crosscheck": {"type": "ARRAY", "items": _COMPANY_SCHEMA}
+            },
+            "required": ["verified", "to_crosscheck"]
+        }
+    },
+    "required": ["ma_transactions", "public_comps"]
+}
+_EXPLAIN_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"name": {"type": "STRING"}, "reason": {"type": "STRING"}},
+        "required": ["name", "reason"]
+    }
+}
+
+def _json_generation_config(schema):
+    """Gemini JSON mode: response is guaranteed to be JSON matching schema."""
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+# Sheet/file name patterns for different comp types (compiled once at import)
+# M&A pattern: Must have M&A/transaction/precedent/deal keywords
+# Matches: "M&A comps", "Transaction comps", "comps M&A", etc.
+# Does NOT match: just "comps" (that's public)
+_MA_COMPS_RE = re.compile(r'(m&a|ma|transaction|precedent|deal|private).*comps|comps.*(m&a|ma|transaction|precedent|deal)', re.IGNORECASE)
+
+# Public pattern: equity/trading/public comps OR just "comps"
+# Matches: "Public comps", "Equity comps", "comps", etc.
+_PUBLIC_COMPS_SHEET_RE = re.compile(r'(equity|trading|public).*comps|^comps$', re.IGNORECASE)
+_PUBLIC_COMPS_FILE_RE = re.compile(r'(equity|trading|public).*comps|^comps', re.IGNORECASE)
+
+# Copilot response parsing
+# "Full Path: " followed by the path, cut at the file extension
+_FULL_PATH_RE = re.compile(r'Full Path:\s*([^\n\r]+?\.(?:xlsx|xls|csv|pptx|pdf))', re.IGNORECASE)
+# Source (filename) and Full Path (folder) when separated: Source: [filename] ... Full Path: [folder]
+_SOURCE_AND_PATH_RE = re.compile(r'Source:\s*([^\n\r]+)(?:[\s\S]*?)Full Path:\s*([^\n\r]+)', re.IGNORECASE)
+_PATH_METADATA_KEYWORDS = ("Modified By", "Source:", "Modifier Email", "Last Modified")
+
+# SharePoint folder name normalization
+# Match patterns like: /Public/, /Public Comps/, /public/, etc.
+_PUBLIC_FOLDER_RE = re.compile(r'/Public(?:\s+Comps)?/', re.IGNORECASE)
+_PUBLIC_FOLDER_PREFIX_RE = re.compile(r'^Public(?:\s+Comps)?/', re.IGNORECASE)
+# Match patterns like: /M&A/, /M&A Comps/, /MA/, /M & A/, etc.
+_MA_FOLDER_RE = re.compile(r'/M\s*&?\s*A(?:\s+Comps)?/', re.IGNORECASE)
+_MA_FOLDER_PREFIX_RE = re.compile(r'^M\s*&?\s*A(?:\s+Comps)?/', re.IGNORECASE)
+
+# Company name canonicalization: trailing "(Exchange:TICKER)" and legal suffixes
+_TICKER_SUFFIX_RE = re.compile(r'\s*\([^)]*\)\s*$')
+_LEGAL_SUFFIX_RE = re.compile(r'[\s,]+(?:inc|corp|ltd|plc)\.?$', re.IGNORECASE)
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9]')
+
+def _canon(name: str) -> str:
+    """
+    Canonical form of a company name for de-duplication, e.g.
+    "Apple Inc.", "APPLE INC", "Apple, Inc" and "Apple Inc. (NasdaqGS:AAPL)" -> "apple".
+    """
+    stripped = _LEGAL_SUFFIX_RE.sub('', _TICKER_SUFFIX_RE.sub('', name.strip()))
+    return _NON_ALNUM_RE.sub('', stripped.lower()) or name.strip().lower()
+
+def _cell_text(value) -> str:
+    """Cell value as text; integral floats (years, counts) print without ".0"."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class DailyQuotaExhausted(genai_errors.ClientError):
+    """
+    Raised by GeminiLimiter when a key's requests-per-day budget is used up.
+    Shaped like Gemini's own per-day 429 so callers take the same backup-key path.
+    """
+    def __init__(self, message: str):
+        super().__init__(429, {"error": {"code": 429, "message": message, "status": "RESOURCE_EXHAUSTED"}})
+
+class GeminiLimiter:
+    def __init__(self, rpm: int = 120, tpm: int = 1_600_000, rpd: int = 800):
+        """
+        Proactive sliding-window limiter for all Gemini calls made with one API key.
+        Defaults are Tier 1 quotas with a 20% safety margin.
+        :param rpm: max requests per minute
+        :param tpm: max (estimated) input tokens per minute
+        :param rpd: max requests per day
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rpd = rpd
+        self._minute = deque()  # (timestamp, tokens) of calls in the last 60s
+        self._minute_tokens = 0
+        self._day = deque()  # timestamps of calls in the last 24h
+        self._lock = asyncio.Lock()
+
+    def _evict(self, now: float):
+        while self._minute and now - self._minute[0][0] >= 60:
+            _, tokens = self._minute.popleft()
+            self._minute_tokens -= tokens
+        while self._day and now - self._day[0] >= 86400:
+            self._day.popleft()
+
+    def _wait_time(self, now: float, est_tokens: int) -> float:
+        """Seconds until the per-minute windows allow a call of est_tokens."""
+        wait = 0.0
+        if len(self._minute) >= self.rpm:
+            wait = max(wait, 60 - (now - self._minute[0][0]))
+        if self._minute and self._minute_tokens + est_tokens > self.tpm:
+            # Wait until enough of the oldest calls have left the window
+            excess = self._minute_tokens + est_tokens - self.tpm
+            for ts, tokens in self._minute:
+                excess -= tokens
+                if excess <= 0:
+                    wait = max(wait, 60 - (now - ts))
+                    break
+        return wait
+
+    async def acquire(self, est_tokens: int):
+        """
+        Wait until the call fits in the per-minute windows, then record its spend.
+        Raises DailyQuotaExhausted instead of waiting (up to 24h) for the day window.
+        """
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                self._evict(now)
+                if len(self._day) >= self.rpd:
+                    raise DailyQuotaExhausted(f"Local limiter: {self.rpd} requests PerDay used up")
+                wait = self._wait_time(now, est_tokens)
+                if wait <= 0:
+                    self._minute.append((now, est_tokens))
+                    self._minute_tokens += est_tokens
+                    self._day.append(now)
+                    return
+            # Sleep without the lock so other callers are not queued behind us; re-check after
+            print(f"[INFO] Gemini rate limiter: waiting {wait:.1f}s")
+            await asyncio.sleep(wait)
+
+def _is_daily_quota_error(e: genai_errors.APIError) -> bool:
+    """
+    True if a 429 is a per-day quota rather than a per-minute throttle.
+    Every Gemini 429 carries a google.rpc.QuotaFailure detail, so classify on the
+    violated quotaId (e.g. GenerateRequestsPerDayPerProjectPerModel), not on "Quota".
+    """
+    if "PerDay" in (e.message or ""):
+        return True
+    body = e.details.get("error", e.details) if isinstance(e.details, dict) else {}
+    for detail in body.get("details") or []:
+        for violation in (detail.get("violations") or []) if isinstance(detail, dict) else []:
+            if "PerDay" in str(violation.get("quotaId", "")):
+                return True
+    return False
+
+# One google-genai client and limiter per API key. Keys are never set globally, so
+# concurrent requests (and a backup-key failover in one of them) cannot affect each other,
+# and each key's quota is tracked separately.
+_gemini_clients = {}
+_gemini_limiters = {}
+
+def get_gemini_client(api_key):
+    """Return the cached Gemini client for api_key."""
+    client = _gemini_clients.get(api_key)
+    if client is None:
+        client = genai_sdk.Client(api_key=api_key)
+        _gemini_clients[api_key] = client
+    return client
+
+def get_gemini_limiter(api_key):
+    """Return the rate limiter shared by all calls made with api_key."""
+    limiter = _gemini_limiters.get(api_key)
+    if limiter is None:
+        limiter = GeminiLimiter()
+        _gemini_limiters[api_key] = limiter
+    return limiter
+
 class GeminiCompanyExtractor:
-    def __init__(self, source, api_key: str, target_company: str = None, max_sheets: int = 10, backup_api_key: str = None):
+    def __init__(self, source, api_key: str, target_company: str = None, max_sheets: int = 10, backup_api_key: str = None, filename: str = None):
         """
         Initialize the extractor with Gemini integration.
-        :param source: file path (str) or BytesIO stream (from SharePoint)
+        :param source: file path (str) or seekable binary stream (from SharePoint)
         :param api_key: Google Gemini API Key
         :param target_company: Name of the target company for context-aware extraction
         :param max_sheets: number of sheets to process
         :param backup_api_key: Optional backup API key for quota exhaustion
+        :param filename: original file name for stream sources (used to detect CSV)
         """
         self.source = source
+        self.filename = filename if filename is not None else (source if isinstance(source, str) else None)
         self.target_company = target_company
         self.max_sheets = max_sheets
         self.api_key = api_key
         self.backup_api_key = backup_api_key
         self.results = {}
+        self.model_used = None  # Model that produced the last extraction (may be the fallback)
         
-        # Configure Gemini
+        # Configure Gemini (per-extractor client, switched on backup-key failover)
         if api_key:
              masked_key = api_key[:4] + "..." + api_key[-4:]
         else:
              print("[ERROR] Gemini API Key is MISSING!")
-        genai.configure(api_key=api_key)
+        self.client = get_gemini_client(api_key)
+        self.limiter = get_gemini_limiter(api_key)
+
+    def _load_workbook(self, source):
+        """
+        Load a workbook with calamine (Rust-backed reader), falling back to openpyxl
+        only if calamine cannot parse the file.
+        :param source: file path (str) or seekable file-like object
+        """
+        try:
+            if isinstance(source, str):
+                return CalamineWorkbook.from_path(source)
+            if isinstance(getattr(source, "name", None), str):
+                # Spilled download: from_filelike would read the whole file back into
+                # memory (and copy it into calamine), so open it by path instead
+                return CalamineWorkbook.from_path(source.name)
+            return CalamineWorkbook.from_filelike(source)
+        except Exception as e:
+            print(f"[INFO] calamine could not read workbook ({e}), falling back to openpyxl")
+            if not isinstance(source, str):
+                source.seek(0)
+            return openpyxl.load_workbook(source, data_only=True, read_only=True, keep_links=False)
+
+    def _visible_sheet_names(self, workbook):
+        """Return visible sheet names in workbook order."""
+        if isinstance(workbook, CalamineWorkbook):
+            return [meta.name for meta in workbook.sheets_metadata if meta.visible == SheetVisibleEnum.Visible]
+        return [name for name in workbook.sheetnames if workbook[name].sheet_state == 'visible']
+
+    def _read_sheet_rows(self, workbook, sheet_name, max_rows=MAX_ROWS_PER_SHEET):
+        """
+        Read cell values of a sheet as a list of rows, stopping after max_rows
+        (only that many rows ever make it into the context).
+        """
+        if isinstance(workbook, CalamineWorkbook):
+            # calamine returns python values directly, empty cells as ""
+            return workbook.get_sheet_by_name(sheet_name).to_python(skip_empty_area=True, nrows=max_rows)
+        # Comps sheets repeat the same strings a lot (tickers, sectors, currencies, "N/A"),
+        # so share one str object per distinct value within the sheet
+        intern_map = {}
+        rows = []
+        for row in islice(workbook[sheet_name].iter_rows(values_only=True), max_rows):
+            row_list = []
+            for cell in row:
+                if cell is None:
+                    row_list.append("")
+                elif isinstance(cell, str):
+                    row_list.append(intern_map.setdefault(cell, cell))
+                else:
+                    # Numbers/dates are rarely duplicated as strings, skip the map
+                    row_list.append(_cell_text(cell))
+            rows.append(row_list)
+        return rows
 
     def _convert_to_dataframe(self, workbook):
         """
-        Convert Excel workbook to DataFrame, identifying both M&A and public comps sheets.
+        Collect raw rows from the workbook, identifying both M&A and public comps sheets.
+        Sheet data maps sheet name -> list of rows (no DataFrame is built).
         Returns: (ma_sheet_data, public_sheet_data, has_ma, has_public)
         """
         ma_sheet_data = {}
         public_sheet_data = {}
-        sheet_names = workbook.sheetnames
-        
-        # Patterns for different comp types
-        # M&A pattern: Must have M&A/transaction/precedent/deal keywords
-        # Matches: "M&A comps", "Transaction comps", "comps M&A", etc.
-        # Does NOT match: just "comps" (that's public)
-        ma_pattern = re.compile(r'(m&a|ma|transaction|precedent|deal|private).*comps|comps.*(m&a|ma|transaction|precedent|deal)', re.IGNORECASE)
-        
-        # Public pattern: equity/trading/public comps OR just "comps"
-        # Matches: "Public comps", "Equity comps", "comps", etc.
-        public_pattern = re.compile(r'(equity|trading|public).*comps|^comps$', re.IGNORECASE)
+        visible_sheets = self._visible_sheet_names(workbook)
         
         ma_sheets = []
         public_sheets = []
         
-        # Identify all matching sheets
-        for name in sheet_names:
-            # Skip hidden sheets
-            if workbook[name].sheet_state != 'visible':
-                continue
-
+        # Identify all matching sheets (hidden sheets are already skipped)
+        for name in visible_sheets:
             name_stripped = name.strip()
             
+            # Both patterns require "comps"; skip the regexes for everything else
+            if "comps" not in name_stripped.lower():
+                continue
+            
             # Check M&A first (more specific)
-            if ma_pattern.search(name_stripped):
+            if _MA_COMPS_RE.search(name_stripped):
                 ma_sheets.append(name)
             # Then check public comps
-            elif public_pattern.search(name_stripped):
+            elif _PUBLIC_COMPS_SHEET_RE.search(name_stripped):
                 public_sheets.append(name)
         
         # Helper to score sheet names for prioritization
@@ -120,105 +376,98 @@ class GeminiCompanyExtractor:
         
         # Process M&A sheets
         for sheet_name in ma_sheets:
-            sheet = workbook[sheet_name]
-            data = []
-            for row in sheet.iter_rows(values_only=True):
-                row_list = [str(cell) if cell is not None else "" for cell in row]
-                data.append(row_list)
-            df = pd.DataFrame(data)
-            ma_sheet_data[sheet_name] = df
+            ma_sheet_data[sheet_name] = self._read_sheet_rows(workbook, sheet_name)
         
         # Process public comps sheets
         for sheet_name in public_sheets:
-            sheet = workbook[sheet_name]
-            data = []
-            for row in sheet.iter_rows(values_only=True):
-                row_list = [str(cell) if cell is not None else "" for cell in row]
-                data.append(row_list)
-            df = pd.DataFrame(data)
-            public_sheet_data[sheet_name] = df
+            public_sheet_data[sheet_name] = self._read_sheet_rows(workbook, sheet_name)
         
         # Fallback: if no specific sheets found, use first 3 visible sheets as public comps
         if not ma_sheets and not public_sheets:
             # No comps sheets found - use first 3 visible sheets as fallback
-            visible_sheets = [n for n in sheet_names if workbook[n].sheet_state == 'visible']
             for sheet_name in visible_sheets[:3]:
-                sheet = workbook[sheet_name]
-                data = []
-                for row in sheet.iter_rows(values_only=True):
-                    row_list = [str(cell) if cell is not None else "" for cell in row]
-                    data.append(row_list)
-                df = pd.DataFrame(data)
-                public_sheet_data[sheet_name] = df
+                public_sheet_data[sheet_name] = self._read_sheet_rows(workbook, sheet_name)
         
         has_ma = len(ma_sheet_data) > 0
         has_public = len(public_sheet_data) > 0
         
         return ma_sheet_data, public_sheet_data, has_ma, has_public
 
-    def _prepare_context_for_gemini(self, sheet_data, max_chars=3200000):
+    def _prepare_context_for_gemini(self, sheet_data, max_chars=3200000, max_rows=MAX_ROWS_PER_SHEET):
         """
-        Prepare Excel data as structured text context for Gemini.
+        Prepare sheet rows as tab-separated text context for Gemini.
+        Rows are streamed into a single buffer against a remaining-chars budget;
+        the string is only materialized once at the end.
         """
-        context = "Below is data from an Excel file containing company information:\n\n"
+        buf = io.StringIO()
+        remaining = max_chars - buf.write("Below is data from an Excel file containing company information:\n\n")
         
-        for sheet_name, df in sheet_data.items():
-            sheet_context = f"=== SHEET: {sheet_name} ===\n"
-            sheet_str = df.head(50).to_json(orient='records')
+        for sheet_name, rows in sheet_data.items():
+            remaining -= buf.write(f"=== SHEET: {sheet_name} ===\n")
             
-            if len(context) + len(sheet_context) + len(sheet_str) > max_chars:
-                remaining_chars = max_chars - len(context) - len(sheet_context)
-                if remaining_chars > 0:
-                    sheet_str = sheet_str[:remaining_chars] + "\n... (truncated due to size limits)"
-                else:
-                    break  # Context limit reached 
+            for row in islice(rows, max_rows):
+                line = "\t".join(map(_cell_text, row))
+                if len(line) >= remaining:
+                    # Context limit reached
+                    buf.write(line[:max(remaining, 0)])
+                    buf.write("\n... (truncated due to size limits)")
+                    return buf.getvalue()
+                remaining -= buf.write(line)
+                remaining -= buf.write("\n")
             
-            sheet_context += sheet_str
-            sheet_context += "\n\n"
-            context += sheet_context
+            remaining -= buf.write("\n")
         
-        if len(context) > max_chars:
-            context = context[:max_chars] + "\n... (truncated due to size limits)"
-        
-        return context
+        return buf.getvalue()
 
-    def extract_with_gemini(self, model_name='gemini-2.5-flash'):
+    def _load_sheet_data(self):
         """
-        Extract data from Excel using Gemini in a single unified call.
-        Includes robust error handling for 503 (Service Unavailable) and 429 (Resource Exhausted).
+        Read the source into sheet name -> rows.
+        CSV files are read directly as a single sheet; workbooks go through sheet detection.
         """
+        is_csv = bool(self.filename) and os.path.splitext(self.filename)[1].lower() == ".csv"
         try:
-            # Load workbook
-            if isinstance(self.source, io.BytesIO):
-                wb = openpyxl.load_workbook(self.source, data_only=True)
-            else:
-                file_ext = os.path.splitext(self.source)[1].lower()
-                if file_ext == ".csv":
-                    df = pd.read_csv(self.source)
-                    buf = io.BytesIO()
-                    df.to_excel(buf, index=False)
-                    buf.seek(0)
-                    wb = openpyxl.load_workbook(buf, data_only=True)
+            if is_csv:
+                # No workbook round-trip for CSV, rows go straight into the context
+                if isinstance(self.source, str):
+                    f = open(self.source, newline='', encoding='utf-8-sig')
                 else:
-                    wb = openpyxl.load_workbook(self.source, data_only=True)
+                    # Closing the wrapper also closes the downloaded stream
+                    f = io.TextIOWrapper(self.source, encoding='utf-8-sig', newline='')
+                with f:
+                    return {"csv": list(islice(csv.reader(f), MAX_ROWS_PER_SHEET))}
+            # Load workbook (calamine first, openpyxl read-only as fallback)
+            wb = self._load_workbook(self.source)
         except Exception as e:
             print(f"ERROR loading workbook: {e}")
+            if not isinstance(self.source, str):
+                self.source.close()
             raise
 
-        # Detect both M&A and public comps sheets
-        ma_sheet_data, public_sheet_data, has_ma, has_public = self._convert_to_dataframe(wb)
-        
-        combined_sheet_data = {}
-        combined_sheet_data.update(ma_sheet_data)
-        combined_sheet_data.update(public_sheet_data)
-        
-        if not combined_sheet_data:
-             wb.close()
-             return None
+        try:
+            # Detect both M&A and public comps sheets
+            ma_sheet_data, public_sheet_data, has_ma, has_public = self._convert_to_dataframe(wb)
+            
+            combined_sheet_data = {}
+            combined_sheet_data.update(ma_sheet_data)
+            combined_sheet_data.update(public_sheet_data)
+            return combined_sheet_data
+        finally:
+            # Both readers keep the underlying file handle open until closed
+            wb.close()
+            if not isinstance(self.source, str):
+                self.source.close()
+
+    def build_prompt(self):
+        """
+        Load the workbook and build the unified extraction prompt.
+        Returns None if the workbook has no usable sheets.
+        """
+        sheet_data = self._load_sheet_data()
+        if not sheet_data:
+            return None
 
         # Prepare context
-        context = self._prepare_context_for_gemini(combined_sheet_data)
-        wb.close()
+        context = self._prepare_context_for_gemini(sheet_data)
 
         # Build Unified Prompt
         target_context = ""
@@ -277,17 +526,44 @@ OUTPUT JSON FORMAT:
   ],
   "public_comps": {{
     "verified": [
-      {{"name": "Company A", "score": 95, "reason": "Direct competitor in X space"}},
+      {{"name": "Company A", "score": 95}},
       ...
     ],
     "to_crosscheck": [
-      {{"name": "Company B", "score": 40, "reason": "Different industry sector"}}
+      {{"name": "Company B", "score": 40}}
     ]
   }}
 }}
-
-CRITICAL: Provide ONLY valid JSON. No markdown formatting.
 """
+        return prompt
+
+    @staticmethod
+    def parse_response(full_response: str):
+        """
+        Parse the unified JSON result of a Gemini JSON mode response.
+        Returns None if the response is not valid JSON.
+        """
+        try:
+            result = orjson.loads(full_response)
+            
+            # Add metadata
+            result['type'] = 'unified' # Signal to caller
+            return result
+
+        except Exception as e:
+            print(f"ERROR in unified extraction: {e}")
+            print(f"Full response was: {full_response}")
+            return None
+
+    async def extract_with_gemini(self, model_name=EXTRACTION_MODEL):
+        """
+        Extract data from Excel using Gemini in a single unified call.
+        Includes robust error handling for 503 (Service Unavailable) and 429 (Resource Exhausted).
+        """
+        # Workbook parsing is blocking CPU/file work; keep it off the event loop
+        prompt = await asyncio.to_thread(self.build_prompt)
+        if prompt is None:
+            return None
         
         current_model_name = model_name
         fallback_model_name = 'gemini-2.5-flash-lite'
@@ -304,61 +580,71 @@ CRITICAL: Provide ONLY valid JSON. No markdown formatting.
         while attempts < max_attempts:
             attempts += 1
             try:
-                model = genai.GenerativeModel(current_model_name)
-                response = model.generate_content(prompt)
+                # Rough token estimate: ~4 chars per token
+                await self.limiter.acquire(len(prompt) // 4)
+                response = await self.client.aio.models.generate_content(
+                    model=current_model_name,
+                    contents=prompt,
+                    config=_json_generation_config(EXTRACTION_SCHEMA)
+                )
                 full_response = response.text
+                self.model_used = current_model_name
                 break # Success!
                 
-            except exceptions.ServiceUnavailable:
-                # 503 Strategy: Retry 1 (Same) -> Retry 2 (Fallback) -> Fail
-                # We reuse the logic from previous task, but integrated here
-                # Simplified:
-                # If attempt 1 -> Wait 2s -> Retry Same
-                # If attempt 2 -> Wait 2s -> Switch Model -> Retry Fallback
-                # If attempt 3 -> Fail
+            except genai_errors.APIError as e:
+                if e.code == 503:
+                    # 503 Strategy: Retry 1 (Same) -> Retry 2 (Fallback) -> Fail
+                    # We reuse the logic from previous task, but integrated here
+                    # Simplified:
+                    # If attempt 1 -> Wait 2s -> Retry Same
+                    # If attempt 2 -> Wait 2s -> Switch Model -> Retry Fallback
+                    # If attempt 3 -> Fail
                 
-                if attempts == 1:
-                    time.sleep(2)
-                    continue
-                elif attempts == 2:
-                    current_model_name = fallback_model_name
-                    time.sleep(2)
-                    continue
-                else:
-                    print("[ERROR] 503 Service Unavailable - All retries exhausted.")
-                    return None
-            
-            except exceptions.ResourceExhausted as e:
-                err_str = str(e)
-                
-                # Check for Quota Limit (PerDay)
-                if "PerDay" in err_str or "Quota" in err_str:
-                    print("[INFO] 429 Type: Quota Limit (PerDay)")
-                    if self.backup_api_key and not used_backup_key:
-                        print("[INFO] Switching to BACKUP API KEY.")
-                        genai.configure(api_key=self.backup_api_key)
-                        used_backup_key = True
-                        # Retry immediately with backup key (same model)
+                    if attempts == 1:
+                        await asyncio.sleep(2)
+                        continue
+                    elif attempts == 2:
+                        current_model_name = fallback_model_name
+                        await asyncio.sleep(2)
                         continue
                     else:
-                        print("[ERROR] Quota limit hit and no backup key available (or already used). Failing.")
+                        print("[ERROR] 503 Service Unavailable - All retries exhausted.")
                         return None
+            
+                elif e.code == 429:
+                    # Check for Quota Limit (PerDay)
+                    if _is_daily_quota_error(e):
+                        print("[INFO] 429 Type: Quota Limit (PerDay)")
+                        if self.backup_api_key and not used_backup_key:
+                            print("[INFO] Switching to BACKUP API KEY.")
+                            self.client = get_gemini_client(self.backup_api_key)
+                            self.limiter = get_gemini_limiter(self.backup_api_key)
+                            used_backup_key = True
+                            # Retry immediately with backup key (same model)
+                            continue
+                        else:
+                            print("[ERROR] Quota limit hit and no backup key available (or already used). Failing.")
+                            return None
                         
-                else: 
-                    # Default to Rate Limit (PerMinute)
-                    print("[INFO] 429 Type: Rate Limit (PerMinute)")
-                    # Strategy:
-                    # 1. Switch to Fallback Model (gemini-2.5-flash-lite) immediately
-                    # 2. Retry
-                    # 3. If fail -> Error
+                    else: 
+                        # Default to Rate Limit (PerMinute)
+                        print("[INFO] 429 Type: Rate Limit (PerMinute)")
+                        # Strategy:
+                        # 1. Switch to Fallback Model (gemini-2.5-flash-lite) immediately
+                        # 2. Retry
+                        # 3. If fail -> Error
                     
-                    if attempts == 1:
-                        current_model_name = fallback_model_name
-                        continue
-                    else:
-                         print("[ERROR] Rate limit retries exhausted (fallback model failed). Failing.")
-                         return None
-                         
+                        if attempts == 1:
+                            current_model_name = fallback_model_name
+                            continue
+                        else:
+                             print("[ERROR] Rate limit retries exhausted (fallback model failed). Failing.")
+                             return None
+
+                else:
+                    print(f"ERROR in unified extraction: {e}")
+                    return None
+
             except Exception as e:
                 print(f"ERROR in unified extraction: {e}")
                 return None
@@ -366,48 +652,20 @@ CRITICAL: Provide ONLY valid JSON. No markdown formatting.
             # Loop finished without break
             return None
 
-        try:
-            # clean response
-            
-            # clean response
-            full_response = full_response.replace('```json', '').replace('```', '').strip()
-            json_start = full_response.find('{')
-            json_end = full_response.rfind('}') + 1
-            
-            if json_start == -1 or json_end == 0:
-                print("ERROR: No JSON found in response")
-                return None
-                
-            json_str = full_response[json_start:json_end]
-            result = json.loads(json_str)
-            
-            # Post-process to ensure structure matches what main.py expects (partially)
-            # We will return the raw unified result, and main.py will handle aggregation.
-            
-            # Add metadata
-            result['type'] = 'unified' # Signal to caller
-            
-            # Capture usage metadata
-            usage = response.usage_metadata
-            usage_stats = {
-                "prompt_token_count": usage.prompt_token_count,
-                "candidates_token_count": usage.candidates_token_count,
-                "total_token_count": usage.total_token_count,
-                "input_char_count": len(prompt)
-            }
-            result['usage'] = usage_stats
-
-            # Stats (optional debugging)
-            ma_count = len(result.get('ma_transactions', []))
-            pub_verified_count = len(result.get('public_comps', {}).get('verified', []))
-            pub_check_count = len(result.get('public_comps', {}).get('to_crosscheck', []))
-            
-            return result
-
-        except Exception as e:
-            print(f"ERROR in unified extraction: {e}")
-            print(f"Full response was: {full_response if 'full_response' in locals() else 'N/A'}")
+        result = self.parse_response(full_response)
+        if result is None:
             return None
+        
+        # Capture usage metadata
+        usage = response.usage_metadata
+        result['usage'] = {
+            "prompt_token_count": usage.prompt_token_count,
+            "candidates_token_count": usage.candidates_token_count,
+            "total_token_count": usage.total_token_count,
+            "input_char_count": len(prompt)
+        }
+        
+        return result
 
 
 class CopilotResponseProcessor:
@@ -424,31 +682,30 @@ class CopilotResponseProcessor:
         self.verified_competitors = []
         self.to_crosscheck = []
         self.file_wise_companies = {}
-        
-        # Configure Gemini
-        genai.configure(api_key=api_key)
 
     def extract_file_paths(self):
         """Extract unique file paths from copilot response and apply filtering logic."""
-        # Pattern to match "Full Path: " followed by the path, cut at file extraction
-        pattern = r'Full Path:\s*([^\n\r]+?\.(?:xlsx|xls|csv|pptx|pdf))'
-        matches = re.findall(pattern, self.copilot_response, re.IGNORECASE)
-        
-        # Explicit safety filter: exclude matches that span lines (newlines/formatting issues)
-        # Also filter out obviously too long paths or paths containing metadata keywords
-        matches = [m for m in matches if '\n' not in m and '\r' not in m and len(m) < 300 and "Modified By" not in m and "Source:" not in m and "Modifier Email" not in m and "Last Modified" not in m]
-        
-        unique_paths = list(set([path.strip() for path in matches]))
+        # Single pass: filter, strip and de-duplicate while keeping response order
+        # Safety filter: skip obviously too long paths or paths containing metadata keywords
+        # (the pattern itself never spans lines)
+        seen = set()
+        unique_paths = []
+        for match in _FULL_PATH_RE.finditer(self.copilot_response):
+            raw = match.group(1)
+            if len(raw) >= 300 or any(keyword in raw for keyword in _PATH_METADATA_KEYWORDS):
+                continue
+            path = raw.strip()
+            if path not in seen:
+                seen.add(path)
+                unique_paths.append(path)
         
         # Apply filtering and balancing logic
         self.file_paths = self._filter_and_balance_files(unique_paths)
         
         # If no paths found, try secondary extraction strategy (Split Source/Path)
         if not self.file_paths:
-             # Pattern to capture Source (filename) and Full Path (folder) when separated
-             # Matches: Source: [filename] ... Full Path: [folder]
-             secondary_pattern = r'Source:\s*([^\n\r]+)(?:[\s\S]*?)Full Path:\s*([^\n\r]+)'
-             matches = re.findall(secondary_pattern, self.copilot_response, re.IGNORECASE)
+             # Capture Source (filename) and Full Path (folder) when separated
+             matches = _SOURCE_AND_PATH_RE.findall(self.copilot_response)
              
              constructed_paths = []
              for filename, folder in matches:
@@ -472,7 +729,7 @@ class CopilotResponseProcessor:
              
              if constructed_paths:
                  # Re-filter/balance with these mew paths
-                 unique_paths = list(set(constructed_paths))
+                 unique_paths = list(dict.fromkeys(constructed_paths))
                  self.file_paths = self._filter_and_balance_files(unique_paths)
 
         # Extract relative paths and normalize them for SharePoint structure
@@ -481,23 +738,18 @@ class CopilotResponseProcessor:
         for path in self.file_paths:
             # First, remove "Shared Documents/" if present (Drive ID handles this)
             if path.startswith("Shared Documents/"):
-                path = path.replace("Shared Documents/", "", 1)
+                path = path[len("Shared Documents/"):]
             
             # Normalize path variations to standard folder names
             # Replace "/Public/" or "/Public Comps/" variations with "/Public Comps/"
-            # import re (Removed to fix UnboundLocalError)
-            # Match patterns like: /Public/, /Public Comps/, /public/, etc.
-            path = re.sub(r'/Public(?:\s+Comps)?/', '/Public Comps/', path, flags=re.IGNORECASE)
+            path = _PUBLIC_FOLDER_RE.sub('/Public Comps/', path)
             # Also handle if it starts with "Public" or "Public Comps"
-            if re.match(r'^Public(?:\s+Comps)?/', path, flags=re.IGNORECASE):
-                path = re.sub(r'^Public(?:\s+Comps)?/', 'Public Comps/', path, flags=re.IGNORECASE)
+            path = _PUBLIC_FOLDER_PREFIX_RE.sub('Public Comps/', path, count=1)
             
             # Replace "/M&A/" or "/M&A Comps/" variations with "/M&A Comps/"
-            # Match patterns like: /M&A/, /M&A Comps/, /MA/, /M & A/, etc.
-            path = re.sub(r'/M\s*&?\s*A(?:\s+Comps)?/', '/M&A Comps/', path, flags=re.IGNORECASE)
+            path = _MA_FOLDER_RE.sub('/M&A Comps/', path)
             # Also handle if it starts with "M&A" variations
-            if re.match(r'^M\s*&?\s*A(?:\s+Comps)?/', path, flags=re.IGNORECASE):
-                path = re.sub(r'^M\s*&?\s*A(?:\s+Comps)?/', 'M&A Comps/', path, flags=re.IGNORECASE)
+            path = _MA_FOLDER_PREFIX_RE.sub('M&A Comps/', path, count=1)
             
             # Now handle the remaining path
             # If path already starts with "All Documents/", use it as-is
@@ -531,10 +783,6 @@ class CopilotResponseProcessor:
         ma_files = []
         public_files = []
         
-        # Regex patterns
-        ma_pattern = re.compile(r'(m&a|ma|transaction|precedent|deal|private).*comps|comps.*(m&a|ma|transaction|precedent|deal)', re.IGNORECASE)
-        public_pattern = re.compile(r'(equity|trading|public).*comps|^comps', re.IGNORECASE)
-        
         for path in file_paths:
             # 1. Folder Path Check (Priority)
             # Normalizing path separators just in case
@@ -549,9 +797,9 @@ class CopilotResponseProcessor:
                  
             # 2. Filename Regex Check (Fallback)
             filename = os.path.basename(path)
-            if ma_pattern.search(filename):
+            if _MA_COMPS_RE.search(filename):
                 ma_files.append(path)
-            elif public_pattern.search(filename):
+            elif _PUBLIC_COMPS_FILE_RE.search(filename):
                 public_files.append(path)
             else:
                 # Default fallback if "comps" is in name
@@ -581,16 +829,36 @@ class CopilotResponseProcessor:
             
         return sorted(list(set(final_files)))
 
+    @staticmethod
+    def _merge_company(company_map: Dict[str, dict], comp: dict):
+        """
+        Merge a competitor entry into company_map keyed by canonical name.
+        Keeps the higher-scoring entry, displayed under the shortest original name.
+        Entries are copied so cached per-file results are never mutated.
+        """
+        name = comp.get('name')
+        if not name:
+            return
+        key = _canon(name)
+        existing = company_map.get(key)
+        if existing is None:
+            company_map[key] = dict(comp)
+            return
+        display = min(existing['name'], name, key=lambda n: (len(n), n))
+        # Keep the one with higher score if duplicate
+        best = comp if comp.get('score', 0) > existing.get('score', 0) else existing
+        company_map[key] = {**best, 'name': display}
+
     def aggregate_unified_results(self, all_extraction_results: List[dict]):
         """
         Aggregate results from multiple files (unified extraction).
         - Consolidated M&A transactions.
-        - De-duplicate and sort verified competitors.
-        - De-duplicate and sort to-crosscheck competitors.
+        - De-duplicate (by canonical company name) and sort verified competitors.
+        - De-duplicate (by canonical company name) and sort to-crosscheck competitors.
         """
         all_ma = []
-        verified_map = {} # name -> {score, reason}
-        crosscheck_map = {} # name -> {score, reason}
+        verified_map = {} # canonical name -> {name, score, reason}
+        crosscheck_map = {} # canonical name -> {name, score, reason}
         
         for result in all_extraction_results:
             if not result:
@@ -601,21 +869,15 @@ class CopilotResponseProcessor:
                 all_ma.extend(result['ma_transactions'])
                 
             # Aggregate Public Comps
-            if 'public_comps' in result:
+            public_comps = result.get('public_comps')
+            if public_comps:
                 # Verified
-                for comp in result['public_comps'].get('verified', []):
-                    name = comp.get('name')
-                    if name:
-                        # Keep the one with higher score if duplicate
-                        if name not in verified_map or comp.get('score', 0) > verified_map[name].get('score', 0):
-                             verified_map[name] = comp
+                for comp in public_comps.get('verified', []):
+                    self._merge_company(verified_map, comp)
                              
                 # To Cross-check
-                for comp in result['public_comps'].get('to_crosscheck', []):
-                    name = comp.get('name')
-                    if name:
-                        if name not in crosscheck_map or comp.get('score', 0) > crosscheck_map[name].get('score', 0):
-                             crosscheck_map[name] = comp
+                for comp in public_comps.get('to_crosscheck', []):
+                    self._merge_company(crosscheck_map, comp)
         
         # Final Processing
         
@@ -647,15 +909,27 @@ class CopilotResponseProcessor:
             "ma_count": len(all_ma)
         }
 
+# Graph token reuse: one MSAL app per process (its own cache handles refresh)
+# plus the last token and its expiry, so most requests skip the login round-trip
+_msal_app = None
+_token_cache = {"token": None, "exp": 0}
+
 def get_graph_token(tenant_id, client_id, client_secret):
-    """Get Microsoft Graph API access token."""
+    """Get Microsoft Graph API access token (cached until shortly before expiry)."""
+    global _msal_app
+    if time.time() < _token_cache["exp"] - 60:
+        return _token_cache["token"]
+
     authority = f"https://login.microsoftonline.com/{tenant_id}"
     try:
-        app = ConfidentialClientApplication(
-            client_id, authority=authority, client_credential=client_secret)
-        token = app.acquire_token_for_client(
+        if _msal_app is None:
+            _msal_app = ConfidentialClientApplication(
+                client_id, authority=authority, client_credential=client_secret)
+        token = _msal_app.acquire_token_for_client(
             scopes=["https://graph.microsoft.com/.default"])
         if "access_token" in token:
+            _token_cache["token"] = token["access_token"]
+            _token_cache["exp"] = time.time() + token.get("expires_in", 3600)
             return token["access_token"]
         else:
             error_desc = token.get("error_description", "No error description")
@@ -664,12 +938,94 @@ def get_graph_token(tenant_id, client_id, client_secret):
     except Exception as e:
         raise Exception(f"Error getting token: {e}")
 
-def search_file_by_name(access_token, drive_id, filename):
+# Shared Graph HTTP client: keep-alive connection pool reused across files and requests
+_graph_client = None
+_GRAPH_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_GRAPH_MAX_RETRIES = 3
+_GRAPH_BACKOFF_FACTOR = 0.5
+DOWNLOAD_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+def get_graph_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled client used for SharePoint/Graph calls."""
+    global _graph_client
+    if _graph_client is None or _graph_client.is_closed:
+        limits = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+        _graph_client = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=120,
+            limits=limits,
+            # Retries connection errors only; status retries are handled below
+            transport=httpx.AsyncHTTPTransport(retries=_GRAPH_MAX_RETRIES, limits=limits)
+        )
+    return _graph_client
+
+async def close_graph_client():
+    """Close the pooled Graph client (on app shutdown)."""
+    global _graph_client
+    if _graph_client is not None:
+        await _graph_client.aclose()
+        _graph_client = None
+
+def _graph_retry_delay(resp: httpx.Response, attempt: int) -> float:
+    """
+    Seconds to wait before retrying: exponential backoff, or the server's
+    Retry-After (seconds or HTTP date) when that is longer.
+    """
+    delay = _GRAPH_BACKOFF_FACTOR * 2 ** attempt
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                delay = max(delay, (retry_at - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+    return delay
+
+async def _graph_get(client: httpx.AsyncClient, url, headers=None):
+    """GET with exponential backoff (honoring Retry-After) on throttling / transient server errors."""
+    for attempt in range(_GRAPH_MAX_RETRIES + 1):
+        resp = await client.get(url, headers=headers)
+        if resp.status_code not in _GRAPH_RETRY_STATUSES or attempt == _GRAPH_MAX_RETRIES:
+            return resp
+        await asyncio.sleep(_graph_retry_delay(resp, attempt))
+
+async def _graph_download(client: httpx.AsyncClient, url, headers=None):
+    """
+    Stream a download with the same retry policy as _graph_get.
+    Small files stay in memory; files over DOWNLOAD_SPOOL_MAX_SIZE spill to a named temp
+    file (deleted on close), which the workbook reader then opens by path so large
+    workbooks never sit fully in the Python heap.
+    Returns None on 404, raises on other HTTP errors.
+    """
+    for attempt in range(_GRAPH_MAX_RETRIES + 1):
+        async with client.stream("GET", url, headers=headers) as resp:
+            if resp.status_code not in _GRAPH_RETRY_STATUSES or attempt == _GRAPH_MAX_RETRIES:
+                if resp.status_code == 404:
+                    return None
+                resp.raise_for_status()
+                buf = io.BytesIO()
+                async for chunk in resp.aiter_bytes(1 << 20):
+                    if isinstance(buf, io.BytesIO) and buf.tell() + len(chunk) > DOWNLOAD_SPOOL_MAX_SIZE:
+                        spilled = tempfile.NamedTemporaryFile()
+                        with buf.getbuffer() as view:
+                            spilled.write(view)
+                        buf.close()
+                        buf = spilled
+                    buf.write(chunk)
+                buf.seek(0)
+                return buf
+            delay = _graph_retry_delay(resp, attempt)
+        await asyncio.sleep(delay)
+
+async def search_file_by_name(client: httpx.AsyncClient, access_token, drive_id, filename):
     """Search for a file by name in SharePoint if direct path fails."""
     search_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root/search(q='{filename}')"
     headers = {"Authorization": f"Bearer {access_token}"}
     try:
-        resp = requests.get(search_url, headers=headers)
+        resp = await _graph_get(client, search_url, headers=headers)
         resp.raise_for_status()
         results = resp.json()
         if "value" in results and len(results["value"]) > 0:
@@ -678,7 +1034,7 @@ def search_file_by_name(access_token, drive_id, filename):
     except Exception:
         return None
 
-def download_file_from_sharepoint(access_token, drive_id, relative_path):
+async def download_file_from_sharepoint(client: httpx.AsyncClient, access_token, drive_id, relative_path):
     """Download file from SharePoint using Microsoft Graph API with fallback search."""
     # Try direct path first
     encoded_path = quote(relative_path, safe='/')
@@ -686,25 +1042,101 @@ def download_file_from_sharepoint(access_token, drive_id, relative_path):
     headers = {"Authorization": f"Bearer {access_token}"}
 
     try:
-        resp = requests.get(url, headers=headers)
+        file_stream = await _graph_download(client, url, headers=headers)
 
-        if resp.status_code == 404:
+        if file_stream is None:
             filename = os.path.basename(relative_path)
-            file_item = search_file_by_name(access_token, drive_id, filename)
+            file_item = await search_file_by_name(client, access_token, drive_id, filename)
 
             if file_item:
                 download_url = file_item.get('@microsoft.graph.downloadUrl')
                 if download_url:
-                    resp = requests.get(download_url)
-                    resp.raise_for_status()
-                    return io.BytesIO(resp.content)
+                    file_stream = await _graph_download(client, download_url)
+                    if file_stream is None:
+                        raise Exception(f"File not found: {filename}")
+                    return file_stream
                 else:
                     raise Exception(f"No download URL for file: {filename}")
             else:
                 raise Exception(f"File not found: {filename}")
 
-        resp.raise_for_status()
-        return io.BytesIO(resp.content)
+        return file_stream
 
     except Exception as e:
         raise Exception(f"Download failed: {e}")
+
+async def submit_gemini_batch(api_key, prompts: Dict[str, str], model_name=EXTRACTION_MODEL):
+    """
+    Submit one extraction prompt per file as a single Gemini Batch Mode job.
+    :param prompts: request key (file path) -> prompt
+    :return: batch job name, used to poll for results
+    """
+    lines = [
+        orjson.dumps({"key": key, "request": {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": {"responseMimeType": "application/json", "responseSchema": EXTRACTION_SCHEMA}
+        }})
+        for key, prompt in prompts.items()
+    ]
+    client = get_gemini_client(api_key)
+    uploaded = await client.aio.files.upload(
+        file=io.BytesIO(b"\n".join(lines)),
+        config={"display_name": "comps-extraction-requests", "mime_type": "jsonl"}
+    )
+    batch_job = await client.aio.batches.create(
+        model=model_name,
+        src=uploaded.name,
+        config={"display_name": "comps-extraction"}
+    )
+    return batch_job.name
+
+async def fetch_gemini_batch(api_key, batch_name):
+    """
+    Poll a Gemini batch job.
+    :return: (state, results) where results maps request key -> response text
+             (or an Exception for failed requests) once the job has succeeded, else None
+    """
+    client = get_gemini_client(api_key)
+    batch_job = await client.aio.batches.get(name=batch_name)
+    state = batch_job.state.name
+    if state != "JOB_STATE_SUCCEEDED":
+        return state, None
+
+    content = await client.aio.files.download(file=batch_job.dest.file_name)
+    results = {}
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        item = orjson.loads(line)
+        key = item.get("key")
+        try:
+            parts = item["response"]["candidates"][0]["content"]["parts"]
+            results[key] = "".join(part.get("text", "") for part in parts)
+        except (KeyError, IndexError) as e:
+            results[key] = Exception(f"Batch request failed: {item.get('error', e)}")
+    return state, results
+
+async def explain_competitors(api_key, target_company: str, names: List[str], model_name=EXTRACTION_MODEL) -> Dict[str, str]:
+    """
+    Fetch a one-sentence rationale per competitor on demand.
+    Extraction only returns names and scores; the UI asks for reasons when it needs them.
+    :return: name -> reason
+    """
+    prompt = f"""TARGET COMPANY: {target_company}
+
+For each company below, explain in one short sentence how it competes with (or differs from) {target_company}.
+
+COMPANIES:
+{chr(10).join(f"- {name}" for name in names)}
+
+OUTPUT JSON FORMAT:
+[{{"name": "Company A", "reason": "Direct competitor in X space"}}, ...]
+"""
+    # Rough token estimate: ~4 chars per token
+    await get_gemini_limiter(api_key).acquire(len(prompt) // 4)
+    response = await get_gemini_client(api_key).aio.models.generate_content(
+        model=model_name,
+        contents=prompt,
+        config=_json_generation_config(_EXPLAIN_SCHEMA)
+    )
+    return {item["name"]: item["reason"] for item in orjson.loads(response.text)}
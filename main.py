@@ -1,20 +1,43 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import os
+import asyncio
 import hashlib
 import re
+import xxhash
 from dotenv import load_dotenv
-from cachetools import TTLCache
-from extractor import CopilotResponseProcessor, GeminiCompanyExtractor, get_graph_token, download_file_from_sharepoint
+import orjson
+from cache import TieredCache, create_backend
+from extractor import (
+    CopilotResponseProcessor, GeminiCompanyExtractor, get_graph_token, download_file_from_sharepoint,
+    get_graph_client, close_graph_client,
+    submit_gemini_batch, fetch_gemini_batch, explain_competitors, EXTRACTION_MODEL, PROMPT_VERSION
+)
 
 # Load environment variables
 load_dotenv()
 
 app = FastAPI(title="Competitor Analysis API")
 
-# Initialize in-memory cache with 48-hour TTL (172800 seconds)
-# Max 100 entries to prevent memory issues
-analysis_cache = TTLCache(maxsize=100, ttl=172800)
+# Shared cache storage (Redis if REDIS_URL is set, else local disk) behind the in-memory caches
+cache_backend = create_backend()
+
+# Per-file extraction results keyed by file content hash (7 days)
+file_extract_cache = TieredCache(
+    "extract:", cache_backend, maxsize=5000, ttl=7 * 86400,
+    dumps=lambda results: orjson.dumps(results).decode(), loads=orjson.loads
+)
+
+# Pending Gemini batch jobs keyed by cache key (batch SLA is 24h, keep for 48h).
+# Shared so a job submitted on one worker can be polled on another.
+batch_jobs = TieredCache(
+    "batch:", cache_backend, maxsize=100, ttl=172800,
+    dumps=lambda job: orjson.dumps(job).decode(), loads=orjson.loads
+)
+
+# Max files downloaded/extracted concurrently per request (keeps Gemini RPM in check)
+MAX_CONCURRENT_FILES = 8
 
 # Configuration
 TENANT_ID = os.getenv("TENANT_ID")
@@ -27,6 +50,7 @@ GEMINI_API_KEY_BACKUP = os.getenv("GEMINI_API_KEY_BACKUP")
 class AnalysisRequest(BaseModel):
     copilot_response: str
     target_company: str
+    batch: bool = False  # Submit as a Gemini batch job (50% cost) and poll /analyze/status/{cache_key}
 
 class AnalysisResponse(BaseModel):
     target_company: str
@@ -50,21 +74,31 @@ class AnalysisResponse(BaseModel):
     
     cached: bool = False  # Indicates if result came from cache
 
-def get_cache_key(target_company: str, file_paths: list) -> str:
+class ExplainRequest(BaseModel):
+    target_company: str
+    names: list  # Competitor names from verified_competitors / to_crosscheck
+
+class ExplainResponse(BaseModel):
+    target_company: str
+    reasons: dict  # name -> short rationale
+
+# Initialize cache with 48-hour TTL (172800 seconds)
+# Max 100 entries in memory to prevent memory issues; the shared backend keeps the rest
+analysis_cache = TieredCache(
+    "analysis:", cache_backend, maxsize=100, ttl=172800,
+    dumps=lambda result: result.model_dump_json(), loads=AnalysisResponse.model_validate_json
+)
+
+def normalize_company_key(company_name: str) -> str:
     """
-    Generate a unique cache key based on target company and file paths.
-    Normalizes company names to improve cache hit rate for variations like:
+    Normalize a company name to improve cache hit rate for variations like:
     - Case differences: "Acme Corp" vs "ACME CORP"
     - Punctuation: "J.P. Morgan" vs "JP Morgan"
     - Suffixes: "Acme Corp" vs "Acme Corporation"
     - Spacing: "Acme Corp" vs "AcmeCorp"
     """
-    # Sort file paths to ensure consistent hashing
-    paths_str = "".join(sorted(file_paths))
-    paths_hash = hashlib.md5(paths_str.encode()).hexdigest()[:8]
-    
     # Enhanced company name normalization
-    company_key = target_company.lower()
+    company_key = company_name.lower()
     
     # Replace all non-alphanumeric characters with underscores
     company_key = re.sub(r'[^a-z0-9]', '_', company_key)
@@ -87,7 +121,138 @@ def get_cache_key(target_company: str, file_paths: list) -> str:
             company_key = company_key[:-len(suffix)].rstrip('_')
             break  # Only remove one suffix
     
-    return f"{company_key}_{paths_hash}"
+    return company_key
+
+def get_cache_key(target_company: str, file_paths: list) -> str:
+    """
+    Generate a unique cache key based on target company and file paths.
+    The company name is normalized with normalize_company_key.
+    """
+    # Sort file paths to ensure consistent hashing; feed them to the (non-cryptographic)
+    # hasher one by one, NUL-separated so ["ab", "c"] and ["a", "bc"] differ
+    hasher = xxhash.xxh3_64()
+    for path in sorted(file_paths):
+        hasher.update(path.encode())
+        hasher.update(b"\0")
+    paths_hash = hasher.hexdigest()[:8]
+    
+    return f"{normalize_company_key(target_company)}_{paths_hash}"
+
+def get_file_extract_key(target_company: str, file_stream) -> str:
+    """
+    Content-addressable key for a single file's extraction result.
+    Hashes the file bytes (with an 8-byte length prefix), so the same workbook
+    hits the cache regardless of its path or which request it arrived in.
+    """
+    size = file_stream.seek(0, os.SEEK_END)
+    file_stream.seek(0)
+    digest = hashlib.sha256(size.to_bytes(8, 'big'))
+    for chunk in iter(lambda: file_stream.read(1 << 20), b""):
+        digest.update(chunk)
+    file_stream.seek(0)
+    return ":".join((EXTRACTION_MODEL, PROMPT_VERSION, normalize_company_key(target_company), digest.hexdigest()))
+
+def has_extracted_data(results) -> bool:
+    """
+    True if a per-file extraction found anything (same rule as the silent-failure
+    check on cached analyses); empty results are not worth caching.
+    """
+    if not results:
+        return False
+    public_comps = results.get('public_comps') or {}
+    return bool(results.get('ma_transactions') or public_comps.get('verified') or public_comps.get('to_crosscheck'))
+
+def collect_file_results(processor, relative_paths: list, file_paths: list, outcomes: list):
+    """
+    Split per-file extraction outcomes into successful results and failed files.
+    Each outcome is an extraction result dict, None, or the Exception raised for that file.
+    Returns: (all_extraction_results, failed_files, processed_count)
+    """
+    all_extraction_results = []
+    failed_files = []
+    processed_count = 0
+    
+    for rel_path, full_path, results in zip(relative_paths, file_paths, outcomes):
+        if isinstance(results, Exception):
+            print(f"[ERROR] ERROR processing file {rel_path}: {str(results)}")
+            failed_files.append({"path": rel_path, "error": str(results)})
+            continue
+        
+        if results:
+            all_extraction_results.append(results)
+            processed_count += 1
+            
+            # Update file logging info
+            ma_count = len(results.get('ma_transactions', []))
+            public_comps = results.get('public_comps', {})
+            pub_verified = len(public_comps.get('verified', []))
+            pub_check = len(public_comps.get('to_crosscheck', []))
+            processor.file_wise_companies[full_path] = f"Extracted: {ma_count} M&A, {pub_verified} Verified, {pub_check} Check"
+            
+        else:
+            failed_files.append({"path": rel_path, "error": "No results returned"})
+    
+    return all_extraction_results, failed_files, processed_count
+
+def build_analysis_response(processor, file_paths: list, all_extraction_results: list, failed_files: list, processed_count: int) -> AnalysisResponse:
+    """Aggregate per-file extraction results into the final AnalysisResponse."""
+    aggregated = processor.aggregate_unified_results(all_extraction_results)
+    
+    # Determine overall data type based on existence of data
+    has_ma = aggregated['ma_count'] > 0
+    has_public = aggregated['verified_count'] > 0 or aggregated['crosscheck_count'] > 0
+
+    if processed_count == 0 and len(failed_files) > 0:
+        final_type = 'error'
+    elif has_ma and has_public:
+        final_type = 'both'
+    elif has_ma:
+        final_type = 'ma_comps'
+    else:
+        final_type = 'public_comps'
+
+    # Helper to sort and limit M&A transactions (consistent with previous logic)
+    def process_ma_transactions(transactions):
+        # Sort by number of non-null metrics
+        def count_metrics(t):
+            metrics = ['revenue', 'valuation', 'ev_revenue', 'ev_ebitda']
+            count = 0
+            for m in metrics:
+                val = t.get(m)
+                if val and str(val).lower() != 'null':
+                    count += 1
+            return count
+        
+        transactions.sort(key=count_metrics, reverse=True)
+        return transactions[:20]
+
+    final_ma_txs = process_ma_transactions(aggregated['ma_transactions'])
+
+    return AnalysisResponse(
+        target_company=processor.target_company,
+        data_type=final_type,
+        
+        # M&A Data
+        ma_transactions=final_ma_txs,
+        transaction_count=len(final_ma_txs),
+        
+        # Public Comps Data
+        verified_competitors=aggregated['verified_competitors'],
+        to_crosscheck=aggregated['to_crosscheck'],
+        verified_count=aggregated['verified_count'],
+        crosscheck_count=aggregated['crosscheck_count'],
+        
+        # Metadata
+        reasoning="Unified Extraction with Unified Reasoning", # Simplified reasoning
+        files_processed=processed_count,
+        total_files_found=len(file_paths),
+        failed_files=failed_files,
+        cached=False
+    )
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_graph_client()
 
 @app.get("/")
 def read_root():
@@ -95,22 +260,25 @@ def read_root():
 
 @app.get("/cache/stats")
 def get_cache_stats():
-    """Get cache statistics"""
+    """Get cache statistics (in-memory layer)"""
     return {
+        "backend": type(cache_backend).__name__,
         "cache_size": len(analysis_cache),
         "max_size": analysis_cache.maxsize,
         "ttl_hours": analysis_cache.ttl / 3600,
-        "entries": list(analysis_cache.keys())
+        "entries": list(analysis_cache.keys()),
+        "file_cache_size": len(file_extract_cache)
     }
 
 @app.delete("/cache")
-def clear_cache():
-    """Clear the entire cache"""
-    analysis_cache.clear()
+async def clear_cache():
+    """Clear the entire cache (in-memory and shared backend)"""
+    await analysis_cache.clear()
+    await file_extract_cache.clear()
     return {"status": "Cache cleared", "cache_size": 0}
 
 @app.post("/analyze", response_model=AnalysisResponse)
-def analyze_competitors(request: AnalysisRequest):
+async def analyze_competitors(request: AnalysisRequest):
     if not all([TENANT_ID, CLIENT_ID, CLIENT_SECRET, DRIVE_ID, GEMINI_API_KEY]):
         raise HTTPException(status_code=500, detail="Server configuration error: Missing environment variables.")
 
@@ -158,8 +326,8 @@ def analyze_competitors(request: AnalysisRequest):
 
         # 3. Check Cache
         cache_key = get_cache_key(request.target_company, file_paths)
-        if cache_key in analysis_cache:
-            cached_result = analysis_cache[cache_key]
+        cached_result = await analysis_cache.get(cache_key)
+        if cached_result is not None:
             
             # Check if the cached result was a "silent failure"
             # 1. Total file failure: All files failed (partial failure is okay)
@@ -189,120 +357,218 @@ def analyze_competitors(request: AnalysisRequest):
                 return cached_result
         
         # Cache miss - process request
+        
+        # A batch job for the same request is already pending; point the client at it
+        pending_job = await batch_jobs.get(cache_key) if request.batch else None
+        if pending_job is not None:
+            return JSONResponse(status_code=202, content={
+                "status": "submitted",
+                "cache_key": cache_key,
+                "batch_name": pending_job["batch_name"],
+                "status_url": f"/analyze/status/{cache_key}"
+            })
 
         # 3. Authenticate with SharePoint
         try:
-            access_token = get_graph_token(TENANT_ID, CLIENT_ID, CLIENT_SECRET)
+            access_token = await asyncio.to_thread(get_graph_token, TENANT_ID, CLIENT_ID, CLIENT_SECRET)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"SharePoint Authentication failed: {str(e)}")
 
         # 4. Process Files
-        all_extraction_results = []
-        failed_files = []
-        processed_count = 0
-        
-        # Usage Accumulators
-        total_input_tokens = 0
-        total_output_tokens = 0
-        total_input_chars = 0
-        per_file_usage = []
-        
-        for rel_path, full_path in zip(relative_paths, file_paths):
-            try:
-                # Download file
-                file_stream = download_file_from_sharepoint(access_token, DRIVE_ID, rel_path)
-                file_size = file_stream.getbuffer().nbytes
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_FILES)
+
+        def make_extractor(file_stream, rel_path):
+            return GeminiCompanyExtractor(
+                source=file_stream, 
+                api_key=GEMINI_API_KEY,
+                target_company=request.target_company,
+                backup_api_key=GEMINI_API_KEY_BACKUP,
+                filename=os.path.basename(rel_path)
+            )
+
+        async def download_and_lookup(client, rel_path):
+            """Download a file and look up its extraction result by content hash."""
+            file_stream = await download_file_from_sharepoint(client, access_token, DRIVE_ID, rel_path)
+            
+            # Skip parsing and Gemini entirely for previously seen file contents
+            extract_key = await asyncio.to_thread(get_file_extract_key, request.target_company, file_stream)
+            cached_results = await file_extract_cache.get(extract_key)
+            if cached_results is not None:
+                file_stream.close()
+            return file_stream, extract_key, cached_results
+
+        async def process_file(client, rel_path):
+            async with semaphore:
+                file_stream, extract_key, cached_results = await download_and_lookup(client, rel_path)
+                if cached_results is not None:
+                    return cached_results
                 
                 # Extract companies or transactions
-                extractor = GeminiCompanyExtractor(
-                    source=file_stream, 
-                    api_key=GEMINI_API_KEY,
-                    target_company=request.target_company,
-                    backup_api_key=GEMINI_API_KEY_BACKUP
-                )
-                
-                results = extractor.extract_with_gemini()
-                
-                if results:
-                    all_extraction_results.append(results)
-                    processed_count += 1
-                    
-                    # Accumulate Usage - REMOVED
-                    pass
-                    
-                    # Update file logging info
-                    ma_count = len(results.get('ma_transactions', []))
-                    pub_verified = len(results.get('public_comps', {}).get('verified', []))
-                    pub_check = len(results.get('public_comps', {}).get('to_crosscheck', []))
-                    processor.file_wise_companies[full_path] = f"Extracted: {ma_count} M&A, {pub_verified} Verified, {pub_check} Check"
-                    
-                else:
-                    failed_files.append({"path": rel_path, "error": "No results returned"})
-            except Exception as e:
-                print(f"[ERROR] ERROR processing file {rel_path}: {str(e)}")
-                failed_files.append({"path": rel_path, "error": str(e)})
-                continue
-        
-        # 5. Aggregate and Build Response
-        aggregated = processor.aggregate_unified_results(all_extraction_results)
-        
-        # Determine overall data type based on existence of data
-        has_ma = aggregated['ma_count'] > 0
-        has_public = aggregated['verified_count'] > 0 or aggregated['crosscheck_count'] > 0
-
-        if processed_count == 0 and len(failed_files) > 0:
-            final_type = 'error'
-        elif has_ma and has_public:
-            final_type = 'both'
-        elif has_ma:
-            final_type = 'ma_comps'
-        else:
-            final_type = 'public_comps'
-
-        # Helper to sort and limit M&A transactions (consistent with previous logic)
-        def process_ma_transactions(transactions):
-            # Sort by number of non-null metrics
-            def count_metrics(t):
-                metrics = ['revenue', 'valuation', 'ev_revenue', 'ev_ebitda']
-                count = 0
-                for m in metrics:
-                    val = t.get(m)
-                    if val and str(val).lower() != 'null':
-                        count += 1
-                return count
-            
-            transactions.sort(key=count_metrics, reverse=True)
-            return transactions[:20]
+                extractor = make_extractor(file_stream, rel_path)
+                results = await extractor.extract_with_gemini()
+                # The key is tied to EXTRACTION_MODEL; don't let a fallback-model result stand in for it
+                if has_extracted_data(results) and extractor.model_used == EXTRACTION_MODEL:
+                    await file_extract_cache.set(extract_key, results)
+                return results
 
-        final_ma_txs = process_ma_transactions(aggregated['ma_transactions'])
+        async def prepare_file(client, rel_path):
+            async with semaphore:
+                file_stream, extract_key, cached_results = await download_and_lookup(client, rel_path)
+                if cached_results is not None:
+                    return extract_key, cached_results, None
+                prompt = await asyncio.to_thread(make_extractor(file_stream, rel_path).build_prompt)
+                return extract_key, None, prompt
 
-        result = AnalysisResponse(
-            target_company=request.target_company,
-            data_type=final_type,
-            
-            # M&A Data
-            ma_transactions=final_ma_txs,
-            transaction_count=len(final_ma_txs),
+        # Fan out all files concurrently; one file's failure doesn't cancel the rest
+        worker = prepare_file if request.batch else process_file
+        client = get_graph_client()
+        outcomes = await asyncio.gather(
+            *(worker(client, rel_path) for rel_path in relative_paths),
+            return_exceptions=True
+        )
+        
+        if request.batch:
+            # Submit all uncached prompts as one Gemini batch job and let the client poll for the result
+            prompts = {}
+            extract_keys = {}
+            cached_outcomes = {}
+            failed_files = []
+            for rel_path, full_path, outcome in zip(relative_paths, file_paths, outcomes):
+                if isinstance(outcome, Exception):
+                    print(f"[ERROR] ERROR processing file {rel_path}: {str(outcome)}")
+                    failed_files.append({"path": rel_path, "error": str(outcome)})
+                    continue
+                extract_key, cached_results, prompt = outcome
+                if cached_results is not None:
+                    cached_outcomes[full_path] = cached_results
+                elif not prompt:
+                    failed_files.append({"path": rel_path, "error": "No results returned"})
+                else:
+                    prompts[full_path] = prompt
+                    extract_keys[full_path] = extract_key
             
-            # Public Comps Data
-            verified_competitors=aggregated['verified_competitors'],
-            to_crosscheck=aggregated['to_crosscheck'],
-            verified_count=aggregated['verified_count'],
-            crosscheck_count=aggregated['crosscheck_count'],
+            if not prompts:
+                # Every file was a cache hit (or failed), nothing to submit
+                cached_paths = [(rel, full) for rel, full in zip(relative_paths, file_paths) if full in cached_outcomes]
+                all_extraction_results, _, processed_count = collect_file_results(
+                    processor, [rel for rel, _ in cached_paths], [full for _, full in cached_paths],
+                    [cached_outcomes[full] for _, full in cached_paths]
+                )
+                result = build_analysis_response(processor, file_paths, all_extraction_results, failed_files, processed_count)
+                if result.data_type != 'error':
+                    await analysis_cache.set(cache_key, result)
+                return result
             
-            # Metadata
-            reasoning="Unified Extraction with Unified Reasoning", # Simplified reasoning
-            files_processed=processed_count,
-            total_files_found=len(file_paths),
-            failed_files=failed_files,
-            cached=False
+            batch_name = await submit_gemini_batch(GEMINI_API_KEY, prompts)
+            await batch_jobs.set(cache_key, {
+                "batch_name": batch_name,
+                "target_company": request.target_company,
+                "file_paths": file_paths,
+                "relative_paths": relative_paths,
+                "failed_files": failed_files,
+                # Content-hash keys of submitted files, to cache their results once the job is done
+                "extract_keys": extract_keys,
+                "cached_results": cached_outcomes
+            })
+            return JSONResponse(status_code=202, content={
+                "status": "submitted",
+                "cache_key": cache_key,
+                "batch_name": batch_name,
+                "status_url": f"/analyze/status/{cache_key}"
+            })
+        
+        all_extraction_results, failed_files, processed_count = collect_file_results(
+            processor, relative_paths, file_paths, outcomes
         )
         
+        # 5. Aggregate and Build Response
+        result = build_analysis_response(processor, file_paths, all_extraction_results, failed_files, processed_count)
+        
         # 6. Store in cache (ONLY if not error)
-        if final_type != 'error':
-            analysis_cache[cache_key] = result
+        if result.data_type != 'error':
+            await analysis_cache.set(cache_key, result)
         
         return result
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+@app.get("/analyze/status/{cache_key}", response_model=AnalysisResponse)
+async def get_batch_status(cache_key: str):
+    """Poll a batch analysis submitted with batch=true."""
+    cached_result = await analysis_cache.get(cache_key)
+    if cached_result is not None:
+        cached_result.cached = True
+        return cached_result
+    
+    job = await batch_jobs.get(cache_key)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No batch job found for key: {cache_key}")
+    
+    try:
+        state, batch_results = await fetch_gemini_batch(GEMINI_API_KEY, job["batch_name"])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch status check failed: {str(e)}")
+    
+    if state in ("JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"):
+        await batch_jobs.pop(cache_key)
+        raise HTTPException(status_code=500, detail=f"Batch job ended with state {state}")
+    if batch_results is None:
+        return JSONResponse(status_code=202, content={"status": state, "cache_key": cache_key})
+    
+    processor = CopilotResponseProcessor(
+        copilot_response="",
+        target_company=job["target_company"],
+        api_key=GEMINI_API_KEY
+    )
+    
+    # Files that failed before submission keep their original error;
+    # files that were cache hits at submission time reuse those results
+    cached_outcomes = job["cached_results"]
+    done = [(rel, full) for rel, full in zip(job["relative_paths"], job["file_paths"])
+            if full in job["extract_keys"] or full in cached_outcomes]
+    outcomes = []
+    for _, full_path in done:
+        if full_path in cached_outcomes:
+            outcomes.append(cached_outcomes[full_path])
+            continue
+        if full_path not in batch_results:
+            # Submitted but no line in the result file
+            outcomes.append(Exception("Missing from batch output"))
+            continue
+        text = batch_results[full_path]
+        if isinstance(text, Exception):
+            outcomes.append(text)
+            continue
+        results = GeminiCompanyExtractor.parse_response(text)
+        if has_extracted_data(results):
+            await file_extract_cache.set(job["extract_keys"][full_path], results)
+        outcomes.append(results)
+    
+    all_extraction_results, failed_files, processed_count = collect_file_results(
+        processor, [rel for rel, _ in done], [full for _, full in done], outcomes
+    )
+    failed_files = job["failed_files"] + failed_files
+    
+    result = build_analysis_response(processor, job["file_paths"], all_extraction_results, failed_files, processed_count)
+    
+    await batch_jobs.pop(cache_key)
+    if result.data_type != 'error':
+        await analysis_cache.set(cache_key, result)
+    
+    return result
+
+@app.post("/explain", response_model=ExplainResponse)
+async def explain(request: ExplainRequest):
+    """Per-competitor rationale, fetched lazily (analysis results carry names and scores only)."""
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="Server configuration error: Missing environment variables.")
+    if not request.names:
+        return ExplainResponse(target_company=request.target_company, reasons={})
+    
+    try:
+        reasons = await explain_competitors(GEMINI_API_KEY, request.target_company, request.names)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Explanation failed: {str(e)}")
+    
+    return ExplainResponse(target_company=request.target_company, reasons=reasons)